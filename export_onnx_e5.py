@@ -0,0 +1,68 @@
+"""export_onnx_e5.py
+
+One-time export of intfloat/e5-large-v2 to ONNX with graph optimization (O2)
+and dynamic INT8 quantization, for RagChromaQuery's backend="onnx".
+
+The INT8 weights exploit AVX512-VNNI int8 dot products on modern CPUs, so a
+single query embedding no longer needs PyTorch (or a GPU) at all.
+
+Requires:  pip install "optimum[onnxruntime]"
+
+Usage:
+  python export_onnx_e5.py --model intfloat/e5-large-v2 --out onnx_e5
+
+Produces onnx_e5/e5_int8.onnx, the default path RagChromaQuery looks for.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default="intfloat/e5-large-v2", help="HF model name")
+    ap.add_argument("--out", default="onnx_e5", help="Output directory")
+    args = ap.parse_args()
+
+    from optimum.onnxruntime import (
+        ORTModelForFeatureExtraction,
+        ORTOptimizer,
+        ORTQuantizer,
+    )
+    from optimum.onnxruntime.configuration import (
+        AutoQuantizationConfig,
+        OptimizationConfig,
+    )
+    from transformers import AutoTokenizer
+
+    print(f"Exporting {args.model} to ONNX ...")
+    model = ORTModelForFeatureExtraction.from_pretrained(args.model, export=True)
+    model.save_pretrained(args.out)
+    AutoTokenizer.from_pretrained(args.model).save_pretrained(args.out)
+
+    print("Optimizing graph (O2) ...")
+    optimizer = ORTOptimizer.from_pretrained(model)
+    optimizer.optimize(
+        save_dir=args.out,
+        optimization_config=OptimizationConfig(optimization_level=2),
+    )
+
+    print("Quantizing to INT8 (dynamic, avx512_vnni) ...")
+    quantizer = ORTQuantizer.from_pretrained(args.out, file_name="model_optimized.onnx")
+    quantizer.quantize(
+        save_dir=args.out,
+        quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False),
+    )
+
+    # ORTQuantizer writes model_optimized_quantized.onnx; rename to the
+    # path RagChromaQuery expects by default.
+    src = os.path.join(args.out, "model_optimized_quantized.onnx")
+    dst = os.path.join(args.out, "e5_int8.onnx")
+    os.replace(src, dst)
+    print(f"Done. INT8 model at {dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,17 +20,16 @@ Enter blank query to exit.
 from __future__ import annotations
 
 import argparse
-import re
-from typing import Optional
+import os
+from multiprocessing.connection import Client
+from typing import List, Optional
 
-from rag_chroma_query import RagChromaQuery
+from rag_chroma_query import RagChromaQuery, RagHit
 
 
-# Extract just the "Content: ..." region from our stored document string
-CONTENT_RE = re.compile(
-    r"\bContent:\s*(?P<content>.*?)(?:\n(?:Checklist Items:|Symptoms:|Root cause:|Fix:|$))",
-    re.DOTALL,
-)
+# Section headers that can follow the "Content: ..." region in our stored
+# document string (see build_document in chromadb_save.py)
+SECTION_HEADERS = ("\nChecklist Items:", "\nSymptoms:", "\nRoot cause:", "\nFix:")
 
 
 STEP_MAP = {
@@ -53,14 +52,41 @@ STEP_DESC = {
 
 
 def extract_content(document: Optional[str]) -> str:
-    """Extract the 'Content:' section from our stored document text."""
+    """Extract the 'Content:' section from our stored document text.
+
+    Single forward scan with str.find instead of a backtracking DOTALL
+    regex: find "Content:", then cut at the nearest following section header.
+    """
     if not document:
         return ""
     doc = document.replace("\r\n", "\n").replace("\r", "\n")
-    m = CONTENT_RE.search(doc)
-    if m:
-        return m.group("content").strip()
-    return doc.replace("passage: ", "", 1).strip()
+    start = doc.find("Content:")
+    if start == -1:
+        return doc.replace("passage: ", "", 1).strip()
+    body_start = start + len("Content:")
+    end = min(
+        (p for p in (doc.find(h, body_start) for h in SECTION_HEADERS) if p != -1),
+        default=len(doc),
+    )
+    return doc[body_start:end].strip()
+
+
+def query_via_daemon(
+    socket_path: str, query: str, step: str, k: int
+) -> Optional[List[RagHit]]:
+    """Send one query to a running rag_embed_server.py daemon.
+
+    Returns the hits, or None if the daemon is unreachable (caller should
+    fall back to an in-process model).
+    """
+    try:
+        with Client(address=socket_path, family="AF_UNIX") as conn:
+            conn.send({"query": query, "step": step, "k": k, "fetch_docs": True})
+            hits = conn.recv()
+            conn.send(None)  # polite goodbye
+            return hits
+    except (OSError, EOFError):
+        return None
 
 
 def print_step_help() -> None:
@@ -89,19 +115,45 @@ def main() -> None:
     ap.add_argument("--collection", default="playwriting_rag_e5_v1", help="Chroma collection name")
     ap.add_argument("--model", default="intfloat/e5-large-v2", help="SentenceTransformers model name")
     ap.add_argument("--device", default=None, help="Optional: cpu/cuda")
+    ap.add_argument("--dtype", default="fp32", choices=["fp32", "fp16", "bf16"],
+                    help="Model precision (fp16/bf16 roughly 2x faster on GPU)")
+    ap.add_argument("--compile", action="store_true",
+                    help="torch.compile the embedder (worth it only for long sessions; "
+                         "first query pays the compile cost)")
+    ap.add_argument("--backend", default="torch", choices=["torch", "onnx"],
+                    help="Embedder backend: torch (SentenceTransformers) or onnx "
+                         "(INT8 e5 via onnxruntime; run export_onnx_e5.py first)")
+    ap.add_argument("--onnx-path", default="onnx_e5/e5_int8.onnx",
+                    help="Quantized ONNX model path (backend=onnx)")
+    ap.add_argument("--socket", default="./emb.sock",
+                    help="rag_embed_server.py socket; used automatically when present")
     args = ap.parse_args()
 
-    rq = RagChromaQuery(
-        db_path=args.db,
-        collection_name=args.collection,
-        model_name=args.model,
-        device=args.device,
-    )
+    # Lazy: only load the model in-process if no embedder daemon is running,
+    # so CLI runs next to rag_embed_server.py skip the multi-second cold start.
+    rq: Optional[RagChromaQuery] = None
+
+    def get_rq() -> RagChromaQuery:
+        nonlocal rq
+        if rq is None:
+            rq = RagChromaQuery(
+                db_path=args.db,
+                collection_name=args.collection,
+                model_name=args.model,
+                device=args.device,
+                dtype=args.dtype,
+                torch_compile=args.compile,
+                backend=args.backend,
+                onnx_path=args.onnx_path,
+            )
+        return rq
 
     print("=" * 88)
     print("RAG Query CLI (E5-large-v2 + ChromaDB)")
     print(f"DB: {args.db}")
     print(f"Collection: {args.collection}")
+    if os.path.exists(args.socket):
+        print(f"Embedder daemon: {args.socket}")
     print("輸入空白 query 直接結束。\n")
     print_step_help()
 
@@ -131,7 +183,11 @@ def main() -> None:
             print("Top-k 不是整數，已使用預設值。\n")
             k = default_k
 
-        hits = rq.query(query=query, step=step, k=k)
+        hits = None
+        if os.path.exists(args.socket):
+            hits = query_via_daemon(args.socket, query, step, k)
+        if hits is None:
+            hits = get_rq().query(query=query, step=step, k=k, fetch_docs=True)
 
         print("\n" + "-" * 88)
         print(f"Results: {len(hits)}  (step={step})")
@@ -8,6 +8,8 @@ Reusable ChromaDB query utilities for your RAG project.
     - passage: <text> for documents (documents should already have this in your DB, but query side always uses query:)
 - Uses normalized embeddings (recommended for E5).
 - Supports step-gated retrieval via metadata filter: where={"pipeline_step": "StepX_..."}
+- Optional backend="onnx": INT8-quantized E5 served via onnxruntime (CPU-friendly,
+  no PyTorch on the query path). Export the model once with export_onnx_e5.py.
 
 Typical usage in other scripts:
 
@@ -27,15 +29,31 @@ Typical usage in other scripts:
 
 from __future__ import annotations
 
+import functools
+import hashlib
+import os
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Sequence, Union
 
 import chromadb
-from sentence_transformers import SentenceTransformer
+import numpy as np
+
+# torch / sentence_transformers are imported lazily inside the torch-backend
+# code paths (mirroring onnxruntime in _init_onnx), so backend="onnx" skips
+# their multi-second import cost entirely.
+
+try:
+    import diskcache
+except ImportError:  # optional: on-disk embedding cache just degrades to memory-only
+    diskcache = None
 
 
 Json = Dict[str, Any]
 
+# Above this many rows in the collection, fall back to Chroma's HNSW index
+# instead of the preloaded brute-force matrix.
+_BRUTE_FORCE_MAX_ROWS = 10000
+
 
 @dataclass
 class RagHit:
@@ -55,6 +73,12 @@ class RagChromaQuery:
         collection_name: str,
         model_name: str = "intfloat/e5-large-v2",
         device: Optional[str] = None,
+        dtype: str = "fp32",
+        torch_compile: bool = False,
+        backend: str = "torch",
+        onnx_path: str = "onnx_e5/e5_int8.onnx",
+        cache_dir: Optional[str] = "./emb_cache",
+        use_brute_force: bool = True,
     ) -> None:
         """
         Args:
@@ -62,26 +86,255 @@ class RagChromaQuery:
             collection_name: The collection name you ingested into.
             model_name: SentenceTransformers model name (default: intfloat/e5-large-v2).
             device: Optional. e.g., "cuda" or "cpu". If None, SentenceTransformer decides.
+            dtype: Model compute precision: "fp32" (default), "fp16" or "bf16".
+                Half precision roughly doubles encode throughput on GPU with
+                negligible cosine drift; embeddings are upcast to fp32 on output.
+                Only applies to the "torch" backend.
+            torch_compile: Wrap the transformer in torch.compile
+                (mode="reduce-overhead") and warm it up once. Worth it for
+                long-lived processes issuing many queries; the first-call
+                compile cost makes it a poor fit for one-shot CLI runs.
+                Only applies to the "torch" backend.
+            backend: "torch" (default, SentenceTransformers) or "onnx"
+                (onnxruntime + INT8-quantized E5; much faster cold start and
+                per-query latency on CPU). Export the model first with
+                export_onnx_e5.py.
+            onnx_path: Path to the quantized .onnx file for backend="onnx".
+            cache_dir: Directory for the on-disk query-embedding cache
+                (needs `diskcache`; silently memory-only if unavailable).
+                Pass None to disable the disk tier.
+            use_brute_force: Preload all embeddings once and answer queries
+                (step-filtered or not) with a numpy matmul over the full
+                matrix — one BLAS matvec beats HNSW's constant overhead on
+                small corpora. Step filters become boolean masks on the
+                score vector. Collections above _BRUTE_FORCE_MAX_ROWS
+                (10000) rows fall back to Chroma's HNSW index.
         """
         self.client = chromadb.PersistentClient(path=db_path)
         self.collection = self.client.get_collection(name=collection_name)
 
+        if backend not in ("torch", "onnx"):
+            raise ValueError('backend must be "torch" or "onnx"')
+        self.backend = backend
+        self.model_name = model_name
+        self.dtype = dtype
+
+        # Two-tier query-embedding cache: in-process LRU over an optional
+        # on-disk fp16 store. Repeated queries skip the E5 forward entirely.
+        self._disk_cache = (
+            diskcache.Cache(cache_dir) if (diskcache is not None and cache_dir) else None
+        )
+        self._embed_cached = functools.lru_cache(maxsize=4096)(self._embed_query_text)
+
+        # Data-layout cache: one global (N, 1024) fp32 matrix plus per-step
+        # boolean masks for brute-force cosine search on small collections.
+        self._E: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._metas: List[Json] = []
+        self._step_mask: Dict[str, np.ndarray] = {}
+        if use_brute_force:
+            self._build_matrix_cache()
+
+        if backend == "onnx":
+            self.model = None
+            self._init_onnx(model_name, onnx_path)
+            return
+
+        import torch
+        from sentence_transformers import SentenceTransformer
+
         # SentenceTransformer handles device internally; you can pass device if you want.
         if device:
             self.model = SentenceTransformer(model_name, device=device)
         else:
             self.model = SentenceTransformer(model_name)
 
+        if dtype == "fp16":
+            self.model.half()
+        elif dtype == "bf16":
+            self.model.bfloat16()
+        elif dtype != "fp32":
+            raise ValueError('dtype must be one of "fp32", "fp16", "bf16"')
+
+        if torch_compile:
+            try:
+                self.model[0].auto_model = torch.compile(
+                    self.model[0].auto_model, mode="reduce-overhead", fullgraph=False
+                )
+                # One warm-up forward so the compile cost is paid here, not
+                # on the first real query.
+                self._embed_query_uncached("warmup")
+            except Exception as e:
+                print(f"warn: torch.compile unavailable ({e}); running eager")
+
+    def _init_onnx(self, model_name: str, onnx_path: str) -> None:
+        """Load the quantized E5 ONNX session + HF fast tokenizer (no PyTorch)."""
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(
+                f"ONNX model not found at {onnx_path!r}. "
+                "Run `python export_onnx_e5.py` first to export + quantize E5."
+            )
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = os.cpu_count() or 1
+        self._onnx_session = ort.InferenceSession(
+            onnx_path, sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self._onnx_input_names = {i.name for i in self._onnx_session.get_inputs()}
+        self._onnx_tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def _onnx_embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed prefixed texts with the ONNX session: mean-pool + L2 normalize."""
+        enc = self._onnx_tokenizer(
+            list(texts), padding=True, truncation=True, max_length=512, return_tensors="np"
+        )
+        feeds = {
+            name: np.asarray(enc[name], dtype=np.int64)
+            for name in self._onnx_input_names
+            if name in enc
+        }
+        last_hidden = self._onnx_session.run(None, feeds)[0].astype(np.float32)
+        mask = np.asarray(enc["attention_mask"], dtype=np.float32)[..., None]
+        emb = (last_hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+        return emb
+
+    def _build_matrix_cache(self) -> None:
+        """Load all embeddings once into a global matrix plus step masks.
+
+        Stored vectors are L2-normalized (E5 convention), so cosine
+        similarity against a normalized query is a plain dot product.
+        """
+        try:
+            # Brute force only ever serves collections under the cap; don't
+            # pull a large collection into memory just to ignore it.
+            if self.collection.count() > _BRUTE_FORCE_MAX_ROWS:
+                return
+            got = self.collection.get(include=["metadatas", "embeddings"])
+        except Exception as e:
+            print(f"warn: could not preload embeddings ({e}); falling back to HNSW")
+            return
+        ids = got.get("ids") or []
+        embs = got.get("embeddings")
+        metas = got.get("metadatas") or []
+        if embs is None or len(ids) == 0:
+            return
+
+        self._E = np.asarray(embs, dtype=np.float32)
+        self._ids = list(ids)
+        self._metas = [m or {} for m in metas]
+        for i, m in enumerate(self._metas):
+            step = m.get("pipeline_step")
+            if step:
+                mask = self._step_mask.get(step)
+                if mask is None:
+                    mask = self._step_mask[step] = np.zeros(len(self._ids), dtype=bool)
+                mask[i] = True
+
+    def _brute_force_query(
+        self, q_emb: Union[Sequence[float], np.ndarray], k: int, step: Optional[str] = None
+    ) -> List[RagHit]:
+        """Exact top-k over the full matrix: one sgemv + argpartition.
+
+        A step filter is applied as a boolean mask on the score vector
+        instead of a separate traversal.
+        """
+        scores = self._E @ np.asarray(q_emb, dtype=np.float32)
+        if step is not None:
+            mask = self._step_mask.get(step)
+            if mask is None:
+                return []
+            scores = np.where(mask, scores, -np.inf)
+            k = min(k, int(mask.sum()))
+        else:
+            k = min(k, len(self._ids))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            RagHit(
+                id=self._ids[i],
+                distance=float(1.0 - scores[i]),  # Chroma cosine distance = 1 - sim
+                document=None,
+                metadata=self._metas[i],
+            )
+            for i in top
+        ]
+
     @staticmethod
     def _e5_query_prefix(text: str) -> str:
         text = (text or "").strip()
         return "query: " + text
 
-    def embed_query(self, query: str) -> List[float]:
-        """Embed a single query using E5 conventions (query: prefix + L2 normalize)."""
+    def _cache_key(self, text: str) -> str:
+        # backend/dtype are part of the key: torch-fp32, torch-fp16 and
+        # onnx-int8 produce slightly different vectors for the same text and
+        # must not share persisted entries. Text is keyed exactly as encoded
+        # (stripped, case-sensitive) so both cache tiers agree.
+        ident = "\x00".join((self.model_name, self.backend, self.dtype, text))
+        return hashlib.blake2b(ident.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _embed_query_text(self, text: str) -> np.ndarray:
+        """Disk-cache lookup around the raw model forward (fp16 on disk)."""
+        key = self._cache_key(text)
+        if self._disk_cache is not None:
+            buf = self._disk_cache.get(key)
+            if buf is not None:
+                return np.frombuffer(buf, dtype=np.float16).astype(np.float32)
+        vec = self._embed_query_uncached(text)
+        if self._disk_cache is not None:
+            self._disk_cache.set(key, vec.astype(np.float16).tobytes())
+        return vec
+
+    def _embed_query_uncached(self, query: str) -> np.ndarray:
         q = self._e5_query_prefix(query)
-        vec = self.model.encode([q], normalize_embeddings=True)
-        return vec[0].tolist()
+        if self.backend == "onnx":
+            return self._onnx_embed([q])[0]
+        import torch
+        with torch.inference_mode():
+            vec = self.model.encode([q], normalize_embeddings=True, convert_to_numpy=True)
+        # Upcast half-precision output to fp32 before handing to Chroma.
+        return np.asarray(vec[0], dtype=np.float32)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a single query using E5 conventions (query: prefix + L2 normalize).
+
+        Results are cached in-process (LRU) and on disk; both tiers key on
+        (model_name, backend, dtype, stripped query text), so repeated
+        queries are ~free and different embedder configurations never share
+        entries.
+        """
+        return self._embed_cached((query or "").strip())
+
+    def embed_queries(self, texts: Sequence[str]) -> np.ndarray:
+        """Batch-embed multiple queries in one encode call (E5 query: prefix).
+
+        Texts are sorted by length before encoding (smart batching) and the
+        (N, 1024) float32 array is returned in the original input order,
+        ready for query_precomputed().
+        """
+        prefixed = [self._e5_query_prefix(t) for t in texts]
+        if self.backend == "onnx":
+            return self._onnx_embed(prefixed).astype(np.float32, copy=False)
+
+        import torch
+
+        order = sorted(range(len(prefixed)), key=lambda i: len(prefixed[i]))
+        with torch.inference_mode():
+            embs = self.model.encode(
+                [prefixed[i] for i in order],
+                batch_size=32,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+            )
+        embs = np.asarray(embs, dtype=np.float32)
+        out = np.empty_like(embs)
+        out[order] = embs
+        return out
 
     def query(
         self,
@@ -89,7 +342,8 @@ class RagChromaQuery:
         step: Optional[str] = None,
         k: int = 6,
         where_extra: Optional[Json] = None,
-        include: Sequence[str] = ("documents", "metadatas", "distances"),
+        include: Sequence[str] = ("metadatas", "distances"),
+        fetch_docs: bool = False,
     ) -> List[RagHit]:
         """
         Query the collection.
@@ -99,12 +353,42 @@ class RagChromaQuery:
             step: If provided, enforces step-gated retrieval: where={"pipeline_step": step}.
             k: Number of results.
             where_extra: Optional additional metadata filters to AND with pipeline_step.
-            include: Chroma include fields.
+            include: Chroma include fields. Documents are excluded by default
+                (Chroma pays a pickle/serialization cost to materialize them);
+                use fetch_docs=True if you need the document bodies.
+            fetch_docs: If True, fetch document text for the returned top-k
+                hits with a small second collection.get call.
 
         Returns:
             List[RagHit]
         """
-        q_emb = self.embed_query(query)
+        return self.query_precomputed(
+            self.embed_query(query), step=step, k=k, where_extra=where_extra,
+            include=include, fetch_docs=fetch_docs,
+        )
+
+    def query_precomputed(
+        self,
+        q_emb: Union[Sequence[float], np.ndarray],
+        step: Optional[str] = None,
+        k: int = 6,
+        where_extra: Optional[Json] = None,
+        include: Sequence[str] = ("metadatas", "distances"),
+        fetch_docs: bool = False,
+    ) -> List[RagHit]:
+        """Same as query(), but takes an already-computed query embedding
+        (e.g., one vector from embed_queries()) and skips the encode."""
+        if (
+            self._E is not None
+            and not where_extra
+            and len(self._ids) <= _BRUTE_FORCE_MAX_ROWS
+        ):
+            hits = self._brute_force_query(q_emb, k, step=step)
+            # Same contract as the Chroma branch: documents are attached when
+            # asked for via include, not only via fetch_docs.
+            if fetch_docs or "documents" in include:
+                self._attach_documents(hits)
+            return hits
 
         where: Optional[Json] = None
         if step and where_extra:
@@ -115,17 +399,26 @@ class RagChromaQuery:
         elif where_extra:
             where = dict(where_extra)
 
+        # Zero-copy handoff: an ndarray from embed_query/embed_queries goes
+        # straight through as a (1, 1024) view — no Python-float boxing and
+        # no conversion inside Chroma.
+        q_arr = np.asarray(q_emb, dtype=np.float32)
+        if q_arr.ndim == 1:
+            q_arr = q_arr[None, :]
+
         res = self.collection.query(
-            query_embeddings=[q_emb],
+            query_embeddings=q_arr,
             n_results=k,
             where=where,
             include=list(include),
         )
 
-        ids = res.get("ids", [[]])[0]
-        dists = res.get("distances", [[]])[0] if "distances" in res else [None] * len(ids)
-        docs = res.get("documents", [[]])[0] if "documents" in res else [None] * len(ids)
-        metas = res.get("metadatas", [[]])[0] if "metadatas" in res else [{}] * len(ids)
+        # Excluded fields come back as keys with value None (chromadb >= 1.x),
+        # so test the value, not key presence.
+        ids = (res.get("ids") or [[]])[0]
+        dists = res["distances"][0] if res.get("distances") else [None] * len(ids)
+        docs = res["documents"][0] if res.get("documents") else [None] * len(ids)
+        metas = res["metadatas"][0] if res.get("metadatas") else [{}] * len(ids)
 
         hits: List[RagHit] = []
         for i, _id in enumerate(ids):
@@ -137,19 +430,58 @@ class RagChromaQuery:
                     metadata=metas[i] if metas else {},
                 )
             )
+
+        if fetch_docs:
+            self._attach_documents(hits)
+
         return hits
 
+    def _attach_documents(self, hits: Sequence[RagHit]) -> None:
+        """Fill in RagHit.document for a small set of hits with one collection.get."""
+        if not hits:
+            return
+        got = self.collection.get(ids=[h.id for h in hits], include=["documents"])
+        doc_by_id = dict(zip(got.get("ids") or [], got.get("documents") or []))
+        for h in hits:
+            h.document = doc_by_id.get(h.id, h.document)
+
     def query_many_steps(
         self,
         query: str,
         steps: Sequence[str],
         k_per_step: int = 4,
-        include: Sequence[str] = ("documents", "metadatas", "distances"),
+        include: Sequence[str] = ("metadatas", "distances"),
+        fetch_docs: bool = False,
     ) -> Dict[str, List[RagHit]]:
-        """Convenience: run the same query against multiple steps (each step is filtered separately)."""
-        out: Dict[str, List[RagHit]] = {}
-        for step in steps:
-            out[step] = self.query(query=query, step=step, k=k_per_step, include=include)
+        """Convenience: run the same query against multiple steps.
+
+        Embeds the query once and issues a single over-fetched, unfiltered
+        Chroma query, then buckets hits by pipeline_step client-side (step
+        cardinality is tiny, so one HNSW traversal replaces N filtered ones).
+        Any step the over-fetch didn't cover falls back to a targeted
+        filtered query with the same embedding.
+        """
+        steps = list(steps)
+        q_emb = self.embed_query(query)
+        out: Dict[str, List[RagHit]] = {s: [] for s in steps}
+
+        inc = list(include)
+        if "metadatas" not in inc:
+            inc.append("metadatas")  # needed for bucketing
+
+        n_results = k_per_step * len(steps) * 3
+        hits = self.query_precomputed(q_emb, step=None, k=n_results, include=inc)
+        for h in hits:
+            bucket = out.get(h.metadata.get("pipeline_step"))
+            if bucket is not None and len(bucket) < k_per_step:
+                bucket.append(h)
+
+        for s in steps:
+            if len(out[s]) < k_per_step:
+                out[s] = self.query_precomputed(q_emb, step=s, k=k_per_step, include=include)
+
+        if fetch_docs:
+            self._attach_documents([h for hs in out.values() for h in hs])
         return out
 
     def get_by_id(
@@ -195,5 +527,6 @@ if __name__ == "__main__":
         "My dialogue feels on-the-nose. How do I add subtext without losing clarity?",
         step="Step6_Details",
         k=6,
+        fetch_docs=True,  # pretty_print shows a document snippet
     )
     pretty_print(hits)
@@ -0,0 +1,87 @@
+"""rag_embed_server.py
+
+Tiny local embedder daemon so CLI runs don't pay the model cold start.
+
+Every invocation of query_cli.py / read_teat.py normally reloads ~1.3GB of
+e5-large-v2 weights (plus CUDA init) before the first query. This daemon
+loads RagChromaQuery once and serves queries over a Unix socket; the CLI
+becomes a thin client and first-query latency drops from seconds to ~ms.
+
+Protocol (multiprocessing.connection over AF_UNIX, pickled dicts):
+    client sends:  {"query": str, "step": str|None, "k": int, "fetch_docs": bool}
+    server sends:  List[RagHit]
+    client sends None (or just disconnects) to end its session.
+
+Usage:
+  python rag_embed_server.py --db ./chroma_db --collection playwriting_rag_e5_v1
+
+While it is running, query_cli.py automatically routes queries to the socket.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from multiprocessing.connection import Listener
+
+from rag_chroma_query import RagChromaQuery
+
+DEFAULT_SOCKET = "./emb.sock"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default="./chroma_db", help="Chroma persistent DB directory")
+    ap.add_argument("--collection", default="playwriting_rag_e5_v1", help="Chroma collection name")
+    ap.add_argument("--model", default="intfloat/e5-large-v2", help="SentenceTransformers model name")
+    ap.add_argument("--device", default=None, help="Optional: cpu/cuda")
+    ap.add_argument("--dtype", default="fp32", choices=["fp32", "fp16", "bf16"])
+    ap.add_argument("--compile", action="store_true",
+                    help="torch.compile the embedder (a daemon lives long enough to amortize it)")
+    ap.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path to listen on")
+    args = ap.parse_args()
+
+    rq = RagChromaQuery(
+        db_path=args.db,
+        collection_name=args.collection,
+        model_name=args.model,
+        device=args.device,
+        dtype=args.dtype,
+        torch_compile=args.compile,
+    )
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)  # stale socket from a previous run
+
+    try:
+        with Listener(address=args.socket, family="AF_UNIX") as listener:
+            print(f"Embedder daemon ready on {args.socket} (Ctrl-C to stop)")
+            while True:
+                with listener.accept() as conn:
+                    try:
+                        while (req := conn.recv()) is not None:
+                            # A bad request (malformed dict, Chroma error)
+                            # must not kill the daemon; reply None so the
+                            # client falls back to its in-process model.
+                            try:
+                                hits = rq.query(
+                                    query=req.get("query", ""),
+                                    step=req.get("step"),
+                                    k=req.get("k", 6),
+                                    fetch_docs=req.get("fetch_docs", True),
+                                )
+                            except Exception as e:
+                                print(f"warn: request failed: {e!r}")
+                                hits = None
+                            conn.send(hits)
+                    except (EOFError, ConnectionError):
+                        pass  # client went away; keep serving
+    except KeyboardInterrupt:
+        print("Bye.")
+    finally:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
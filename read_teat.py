@@ -13,6 +13,7 @@ If you omit args, it uses defaults below.
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
 
 from rag_chroma_query import RagChromaQuery, pretty_print
@@ -120,13 +121,26 @@ def main() -> None:
 
     tests = build_tests()
 
-    for name, step, q in tests:
+    # Encode all test queries in one batch (single model.encode call) instead
+    # of 13 separate single-query forwards.
+    q_embs = rq.embed_queries([q for _, _, q in tests])
+
+    # The tests are independent and Chroma releases the GIL during search,
+    # so run the retrieval side on a small thread pool. Printing stays
+    # sequential in the original test order.
+    with ThreadPoolExecutor(max_workers=min(8, len(tests))) as pool:
+        futures = [
+            pool.submit(rq.query_precomputed, q_emb, step=step, k=args.k, fetch_docs=True)
+            for (_, step, _), q_emb in zip(tests, q_embs)
+        ]
+        results = [f.result() for f in futures]
+
+    for (name, step, q), hits in zip(tests, results):
         print("=" * 88)
         print(f"{name}")
         print(f"step={step}")
         print(f"query={q}")
         print("-" * 88)
-        hits = rq.query(query=q, step=step, k=args.k)
         pretty_print(hits)
 
         # Special check: confirm pipeline_step in top hit metadata for the gate test
@@ -0,0 +1,114 @@
+"""Regression tests for the Chroma query path in rag_chroma_query.py.
+
+Run with:  python -m pytest test_rag_chroma_query.py
+
+The embedding model is never loaded: RagChromaQuery is wired up around an
+in-memory Chroma collection with precomputed vectors, and queries go through
+query_precomputed. The brute-force matrix cache is left empty so every query
+exercises the real collection.query fallback.
+"""
+
+from __future__ import annotations
+
+import uuid
+
+import chromadb
+import numpy as np
+import pytest
+
+from rag_chroma_query import RagChromaQuery
+
+N, DIM = 12, 8
+
+
+@pytest.fixture()
+def rq():
+    client = chromadb.EphemeralClient()
+    # EphemeralClient state is shared within the process; unique name per test.
+    col = client.create_collection(
+        f"test_cards_{uuid.uuid4().hex[:8]}", metadata={"hnsw:space": "cosine"}
+    )
+    rng = np.random.default_rng(0)
+    embs = rng.normal(size=(N, DIM)).astype(np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    col.add(
+        ids=[f"id{i}" for i in range(N)],
+        embeddings=embs,
+        metadatas=[{"pipeline_step": f"Step{i % 3}"} for i in range(N)],
+        documents=[f"passage: doc {i}" for i in range(N)],
+    )
+
+    # Bypass __init__ (no model load); wire up only what the query path needs.
+    rq = RagChromaQuery.__new__(RagChromaQuery)
+    rq.collection = col
+    rq._E = None  # empty matrix cache -> force the Chroma/HNSW path
+    rq._ids, rq._metas, rq._step_mask = [], [], {}
+    rq.q0 = embs[0]  # a known query vector whose nearest neighbour is id0
+    return rq
+
+
+def test_chroma_path_default_include(rq):
+    # chromadb >= 1.x returns excluded fields as None-valued keys; with the
+    # documents-excluded default include this used to crash with TypeError.
+    hits = rq.query_precomputed(rq.q0, step="Step0", k=3)
+    assert len(hits) == 3
+    assert hits[0].id == "id0"
+    assert all(h.document is None for h in hits)
+    assert all(h.metadata["pipeline_step"] == "Step0" for h in hits)
+    assert all(np.isfinite(h.distance) for h in hits)
+
+
+def test_chroma_path_fetch_docs(rq):
+    hits = rq.query_precomputed(rq.q0, k=2, fetch_docs=True)
+    assert hits[0].id == "id0"
+    assert hits[0].document == "passage: doc 0"
+
+
+def test_chroma_path_minimal_include(rq):
+    # Even metadatas/distances excluded must not crash.
+    hits = rq.query_precomputed(rq.q0, k=2, include=("distances",))
+    assert len(hits) == 2
+    assert hits[0].metadata == {}
+
+
+@pytest.fixture()
+def rq_bf(rq):
+    """Same wiring, but with the brute-force matrix cache built — the
+    default path for every query against a small collection."""
+    rq._build_matrix_cache()
+    assert rq._E is not None and rq._E.shape == (N, DIM)
+    return rq
+
+
+def test_brute_force_matches_chroma(rq_bf):
+    # Unfiltered and step-filtered brute-force results must be identical
+    # (ids and distances) to Chroma's own HNSW answers.
+    for step in (None, "Step1"):
+        hits = rq_bf.query_precomputed(rq_bf.q0, step=step, k=3)
+        res = rq_bf.collection.query(
+            query_embeddings=[rq_bf.q0.tolist()],
+            n_results=3,
+            where={"pipeline_step": step} if step else None,
+        )
+        assert res["ids"][0] == [h.id for h in hits]
+        for dist, h in zip(res["distances"][0], hits):
+            assert abs(dist - h.distance) < 1e-4
+
+
+def test_brute_force_unknown_step_and_k_cap(rq_bf):
+    assert rq_bf.query_precomputed(rq_bf.q0, step="StepX", k=3) == []
+    # k larger than the shard is capped at the shard size (N/3 rows per step).
+    hits = rq_bf.query_precomputed(rq_bf.q0, step="Step0", k=99)
+    assert len(hits) == N // 3
+    assert all(h.metadata["pipeline_step"] == "Step0" for h in hits)
+
+
+def test_brute_force_include_documents(rq_bf):
+    # include=("documents", ...) must attach documents on the brute path,
+    # same contract as the Chroma branch.
+    hits = rq_bf.query_precomputed(
+        rq_bf.q0, k=2, include=("documents", "metadatas", "distances")
+    )
+    assert hits[0].document == "passage: doc 0"
+    hits = rq_bf.query_precomputed(rq_bf.q0, k=2)
+    assert all(h.document is None for h in hits)